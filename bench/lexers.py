@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Compares code2tex's LexerIndex against pygments' filename lookup
+
+Resolves the lexer of every file name under the given directories (or of a
+synthetic name for every pygments filename pattern if none are given) with
+both pygments.lexers.get_lexer_for_filename() and LexerIndex, and prints the
+time taken by each and the number of names on which they disagree.
+"""
+import argparse
+import os
+import os.path
+import sys
+import time
+
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+
+import pykutils.code2tex
+
+
+def synthetic_names():
+    """Returns a file name matching each pygments filename pattern"""
+    import pygments.lexers
+    names = []
+    for _, _, patterns, _ in pygments.lexers.get_all_lexers():
+        for x in patterns:
+            x = x.replace('*', 'x').replace('?', 'x')
+            while '[' in x:
+                i = x.index('[')
+                j = x.index(']', i)
+                x = x[:i] + x[i + 1] + x[j + 1:]
+            names.append(x)
+    names.extend(['README', 'x.unknownext', 'Makefile', 'x.tar.gz'])
+    return names
+
+
+def walk_names(paths):
+    names = []
+    for path in paths:
+        for _, _, filenames in os.walk(path):
+            names.extend(filenames)
+    return names
+
+
+def pygments_lookup(names):
+    import pygments.lexers
+    import pygments.util
+    out = []
+    for x in names:
+        try:
+            out.append(type(pygments.lexers.get_lexer_for_filename(x)))
+        except pygments.util.ClassNotFound:
+            out.append(type(pygments.lexers.get_lexer_by_name('text')))
+    return out
+
+
+def index_lookup(names):
+    lexers = pykutils.code2tex.LexerIndex()
+    return [type(lexers.get_lexer(x)) for x in names]
+
+
+def main(args=None, prog=None):
+    """Main entry point"""
+    if args is None:
+        args = sys.argv[1:]
+    p = argparse.ArgumentParser(prog=prog, description='Compares LexerIndex '
+                                'against pygments filename lookup')
+    p.add_argument('-n', '--repeat', type=int, default=3,
+                   help='Number of runs (best time is reported)')
+    p.add_argument('paths', nargs='*', metavar='DIR',
+                   help='Directories to take file names from')
+    args = p.parse_args(args)
+    names = walk_names(args.paths) if args.paths else synthetic_names()
+    results = {}
+    for name, fn in (('pygments', pygments_lookup), ('index', index_lookup)):
+        best = None
+        for _ in range(args.repeat):
+            start = time.time()
+            results[name] = fn(names)
+            t = time.time() - start
+            best = t if best is None else min(best, t)
+        print('{0}\t{1} names\t{2:.3f}s\t{3:.1f}us/name'.format(
+            name, len(names), best, best / max(len(names), 1) * 1e6))
+    mismatches = [(x, a.__name__, b.__name__) for x, a, b in
+                  zip(names, results['pygments'], results['index']) if a != b]
+    print('mismatches\t{0}'.format(len(mismatches)))
+    for x in mismatches:
+        print('\t'.join(x))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:], sys.argv[0]))
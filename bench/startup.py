@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Measures startup time of pykutils entry points
+
+For each console entry point, runs `python -X importtime` on the module
+import and on `--help`, and prints one line per entry point with the
+cumulative import time of the module (in microseconds) and the wall-clock
+time of `--help` (in milliseconds). Output is tab-separated so that it can
+be appended to a log and tracked over time.
+"""
+import argparse
+import os
+import os.path
+import re
+import subprocess
+import sys
+import time
+
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+entry_points = ['btrup', 'code2tex', 'pykhome', 'wgetmirror']
+
+
+def import_time(module, python=sys.executable):
+    """Returns cumulative import time of `module` in microseconds"""
+    args = [python, '-X', 'importtime', '-c', 'import {0}'.format(module)]
+    p = subprocess.Popen(args, cwd=root, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.PIPE, universal_newlines=True)
+    _, stderr = p.communicate()
+    if p.returncode != 0:
+        raise subprocess.CalledProcessError(p.returncode, args)
+    # Only count the package and the module itself (which includes all of
+    # its imports), not interpreter startup
+    names = {'pykutils', module}
+    total = 0
+    for line in stderr.splitlines():
+        m = re.match(r'^import time:\s+\d+ \|\s+(\d+) \| (\S+)$', line)
+        if m and m.group(2) in names:
+            total += int(m.group(1))
+    return total
+
+
+def help_time(name, python=sys.executable):
+    """Returns wall-clock time of `name --help` in milliseconds"""
+    args = [python, os.path.join(root, 'bin', name), '--help']
+    start = time.time()
+    subprocess.check_call(args, stdout=subprocess.DEVNULL)
+    return (time.time() - start) * 1000
+
+
+def main(args=None, prog=None):
+    """Main entry point"""
+    if args is None:
+        args = sys.argv[1:]
+    p = argparse.ArgumentParser(prog=prog, description='Measures startup '
+                                'time of pykutils entry points')
+    p.add_argument('-n', '--repeat', type=int, default=5,
+                   help='Number of runs (best time is reported)')
+    p.add_argument('--python', default=sys.executable,
+                   help='Python interpreter to benchmark')
+    p.add_argument('names', nargs='*', metavar='NAME',
+                   help='Entry points to benchmark (default: all)')
+    args = p.parse_args(args)
+    names = args.names or entry_points
+    for name in names:
+        module = 'pykutils.{0}'.format(name)
+        imp = min(import_time(module, args.python)
+                  for _ in range(args.repeat))
+        hlp = min(help_time(name, args.python) for _ in range(args.repeat))
+        print('{0}\t{1}us\t{2:.1f}ms'.format(name, imp, hlp))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:], sys.argv[0]))
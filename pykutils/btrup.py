@@ -3,17 +3,13 @@
 # TODO: VT100 progress bar
 # TODO: Remove duplicate code
 import argparse
-import collections
-import logging
 import os
 import os.path
 import re
 import string
 import subprocess
 import sys
-import tempfile
 import time
-import uuid
 
 
 class Host(object):
@@ -78,6 +74,7 @@ class Host(object):
 
     def send(self, subvol, parent=None):
         """Performs btrfs send"""
+        import uuid
         args = 'btrfs send'
         if parent:
             args += ' -p {0}'.format(subprocess.list2cmdline([parent]))
@@ -117,6 +114,7 @@ class SSHHost(Host):
     __p = None
 
     def __init__(self, host):
+        import tempfile
         Host.__init__(self)
         self.host = host
         self.__d = tempfile.TemporaryDirectory()
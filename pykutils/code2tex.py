@@ -4,10 +4,6 @@ import os
 import re
 import signal
 import sys
-import pygments
-import pygments.formatters
-import pygments.lexers
-import pygments.styles
 
 
 headerfmt = r"""\documentclass[a4paper,english,10pt,final]{{article}}
@@ -45,40 +41,680 @@ def filter_tex(x):
     return re.sub(r'([_\\])', lambda m: '\\{}'.format(m.group(1)), x)
 
 
-def get_lexer_for_filename(x):
-    try:
-        return pygments.lexers.get_lexer_for_filename(x)
-    except:
-        # Fallback to plain text formatting
-        return pygments.lexers.get_lexer_by_name('text')
+def _glob_regex(pattern):
+    import fnmatch
+    return re.compile(fnmatch.translate(pattern))
+
+
+class LexerIndex(object):
+    """Maps filenames to lexers without scanning the patterns of every
+    registered lexer.
+
+    The index is built once from pygments' lexer list, and is optionally
+    persisted as JSON to `path`, where it is reused as long as the pygments
+    version matches. `overrides` is a list of (glob, lexer alias) pairs which
+    take precedence over pygments' patterns, first match wins. Lexer
+    instances are shared between files with the same lexer class.
+    """
+
+    def __init__(self, overrides=(), path=None):
+        #: (glob, lexer alias) pairs
+        self.overrides = tuple(overrides)
+        #: Path of persisted index, or None
+        self.path = path
+        self._overrides = []
+        if self.overrides:
+            import pygments.lexers
+            for pattern, alias in self.overrides:
+                cls = pygments.lexers.find_lexer_class_by_name(alias)
+                self._overrides.append((_glob_regex(pattern), cls))
+        #: Exact filename -> [(lexer name, pattern)]
+        self._filenames = {}
+        #: Extension (e.g. '.py') -> [(lexer name, pattern)]
+        self._extensions = {}
+        #: [(lexer name, pattern, regex)] for all other patterns
+        self._patterns = []
+        #: basename -> lexer class
+        self._resolved = {}
+        #: lexer class -> lexer instance
+        self._lexers = {}
+        if not (path and self._load()):
+            self._build()
+            if path:
+                self._save()
+
+    def _build(self):
+        import pygments.lexers
+        for name, _, patterns, _ in pygments.lexers.get_all_lexers():
+            for pattern in patterns:
+                self._add(name, pattern)
+
+    def _add(self, name, pattern):
+        if not any(c in pattern for c in '*?['):
+            self._filenames.setdefault(pattern, []).append((name, pattern))
+        elif (pattern.startswith('*.') and
+              not any(c in pattern[1:] for c in '*?[')):
+            self._extensions.setdefault(pattern[1:], []).append((name,
+                                                                 pattern))
+        else:
+            self._patterns.append((name, pattern, _glob_regex(pattern)))
+
+    def _load(self):
+        """Loads persisted index. Returns True on success."""
+        import json
+        import pygments
+        try:
+            f = open(self.path, 'r', encoding='utf-8')
+        except IOError:
+            return False
+        try:
+            data = json.load(f)
+        except ValueError:
+            return False
+        finally:
+            f.close()
+        if data.get('version') != pygments.__version__:
+            return False
+        for name, pattern in data['patterns']:
+            self._add(name, pattern)
+        return True
+
+    def _save(self):
+        import json
+        import pygments
+        import tempfile
+        patterns = [[name, pattern]
+                    for x in (self._filenames, self._extensions)
+                    for y in x.values() for name, pattern in y]
+        patterns.extend([name, pattern] for name, pattern, _ in self._patterns)
+        data = {'version': pygments.__version__, 'patterns': patterns}
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.')
+        f = open(fd, 'w', encoding='utf-8')
+        json.dump(data, f)
+        f.close()
+        os.replace(tmppath, self.path)
+
+    def _candidates(self, fn):
+        matches = list(self._filenames.get(fn, ()))
+        i = fn.find('.')
+        while i != -1:
+            matches.extend(self._extensions.get(fn[i:], ()))
+            i = fn.find('.', i + 1)
+        matches.extend((name, pattern) for name, pattern, regex
+                       in self._patterns if regex.match(fn))
+        return matches
+
+    def find_lexer_class(self, path):
+        """Returns lexer class for `path`, or None"""
+        import pygments.lexers
+        fn = os.path.basename(path)
+        try:
+            return self._resolved[fn]
+        except KeyError:
+            pass
+        for regex, cls in self._overrides:
+            if regex.match(fn):
+                break
+        else:
+            matches = [(pygments.lexers.find_lexer_class(name), pattern)
+                       for name, pattern in self._candidates(fn)]
+
+            def get_rating(info):
+                # Same rating as pygments.lexers.get_lexer_for_filename()
+                cls, pattern = info
+                bonus = '*' not in pattern and 0.5 or 0
+                return cls.priority + bonus, cls.__name__
+
+            matches = [x for x in matches if x[0] is not None]
+            cls = max(matches, key=get_rating)[0] if matches else None
+        self._resolved[fn] = cls
+        return cls
+
+    def get_lexer(self, path):
+        """Returns lexer instance for `path`, falling back to plain text"""
+        import pygments.lexers
+        cls = self.find_lexer_class(path)
+        if cls is None:
+            cls = pygments.lexers.find_lexer_class_by_name('text')
+        if cls not in self._lexers:
+            self._lexers[cls] = cls()
+        return self._lexers[cls]
+
+
+_lexer_indexes = {}
+
+
+def get_lexer_index(overrides=(), path=None):
+    """Returns the LexerIndex for `overrides` and `path`, building it at most
+    once per process"""
+    key = (tuple(overrides), path)
+    if key not in _lexer_indexes:
+        _lexer_indexes[key] = LexerIndex(overrides, path)
+    return _lexer_indexes[key]
+
+
+def get_lexer_for_filename(x, lexers=None):
+    if lexers is None:
+        lexers = get_lexer_index()
+    return lexers.get_lexer(x)
 
 
 def list_styles(out):
+    import pygments.styles
     for x in pygments.styles.get_all_styles():
         out.write(x)
         out.write('\n')
 
 
-def code2tex(out, paths, style='default', title='', author='',
-             headerfmt=headerfmt, footerfmt=footerfmt, blockfmt=blockfmt):
-    """Formats `paths` into LaTeX"""
+def get_formatter(style='default'):
+    """Returns the TeX formatter for style name `style`"""
+    import pygments.formatters
+    import pygments.styles
     style = pygments.styles.get_style_by_name(style)
-    formatter = pygments.formatters.get_formatter_by_name('tex', linenos=True,
-                                                          style=style)
+    return pygments.formatters.get_formatter_by_name('tex', linenos=True,
+                                                     style=style)
+
+
+class HighlightCache(object):
+    """Content-addressed on-disk cache of highlighted LaTeX fragments.
+
+    Entries are keyed by a hash of the file contents, lexer, style, formatter
+    options and pygments version. Entry mtimes are bumped on every hit, and
+    the least recently used entries are evicted by `evict()` once the cache
+    grows beyond `max_size` bytes.
+    """
+
+    def __init__(self, path, max_size=100*1024*1024):
+        #: Cache directory
+        self.path = path
+        #: Maximum total size of cache entries in bytes
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, contents, lexer, formatter):
+        """Returns cache key for highlighting `contents` with `lexer` and
+        `formatter`"""
+        import hashlib
+        import pygments
+        style = formatter.style
+        options = [(k, v) for k, v in sorted(formatter.options.items())
+                   if k != 'style']
+        meta = [pygments.__version__,
+                type(lexer).__module__, type(lexer).__name__,
+                sorted(lexer.options.items()),
+                type(formatter).__name__,
+                '{0}.{1}'.format(style.__module__, style.__name__),
+                options]
+        m = hashlib.sha256()
+        m.update(repr(meta).encode('utf-8'))
+        m.update(b'\0')
+        m.update(contents.encode('utf-8'))
+        return m.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def get(self, key):
+        """Returns cached fragment for `key`, or None"""
+        path = self._entry_path(key)
+        try:
+            f = open(path, 'r', encoding='utf-8')
+        except IOError:
+            self.misses += 1
+            return None
+        value = f.read()
+        f.close()
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Stores fragment `value` under `key`"""
+        import tempfile
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so that concurrent readers never see
+        # a partially written entry
+        fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path))
+        f = open(fd, 'w', encoding='utf-8')
+        f.write(value)
+        f.close()
+        os.replace(tmppath, path)
+
+    def evict(self):
+        """Evicts least recently used entries until the cache is no larger
+        than `max_size`"""
+        entries = []
+        total = 0
+        try:
+            dirs = list(os.scandir(self.path))
+        except OSError:
+            return
+        for d in dirs:
+            if not d.is_dir():
+                continue
+            for x in os.scandir(d.path):
+                st = x.stat()
+                entries.append((st.st_mtime, st.st_size, x.path))
+                total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        """Returns hit/miss statistics as a string"""
+        lookups = self.hits + self.misses
+        ratio = self.hits / lookups * 100 if lookups else 0.0
+        return '{0} hits, {1} misses ({2:.1f}% hit rate), {3} evictions' \
+            .format(self.hits, self.misses, ratio, self.evictions)
+
+
+def default_cache_dir():
+    return os.path.join(os.path.expanduser('~'), '.cache', 'pykutils',
+                        'code2tex')
+
+
+def highlight(path, formatter, blockfmt=blockfmt, cache=None, lexers=None):
+    """Returns the LaTeX block for file `path`
+
+    If `cache` is a HighlightCache, the highlighted fragment is looked up
+    there first, and stored there on a miss. `lexers` is the LexerIndex used
+    to find the lexer for `path`.
+    """
+    import pygments
+    lexer = get_lexer_for_filename(path, lexers)
+    f = open(path, 'r', errors='ignore')
+    contents = f.read()
+    f.close()
+    if cache is not None:
+        key = cache.key(contents, lexer, formatter)
+        highlighted = cache.get(key)
+        if highlighted is None:
+            highlighted = pygments.highlight(contents, lexer, formatter)
+            cache.put(key, highlighted)
+    else:
+        highlighted = pygments.highlight(contents, lexer, formatter)
+    return blockfmt.format(path=filter_tex(path), content=highlighted)
+
+
+def _stream_tokens(f, lexer, chunk_size):
+    """Yields tokens of file `f`, lexing `chunk_size` characters of whole lines
+    at a time.
+
+    Leading and trailing blank lines are stripped as pygments does for whole
+    files. Constructs spanning a chunk boundary may be highlighted
+    differently.
+    """
+    first = True
+    blank = ''
+    while True:
+        lines = f.readlines(chunk_size)
+        if not lines:
+            break
+        text = blank + ''.join(lines)
+        if first:
+            text = text.lstrip('\n')
+        # Hold back trailing blank lines until we know they are not at EOF
+        stripped = text.rstrip('\n')
+        if not stripped:
+            blank = text
+            continue
+        first = False
+        blank = text[len(stripped) + 1:]
+        for x in lexer.get_tokens(stripped + '\n'):
+            yield x
+    if first:
+        # Empty or blank file: pygments still emits a single empty line
+        for x in lexer.get_tokens('\n'):
+            yield x
+
+
+def highlight_stream(out, path, formatter, blockfmt=blockfmt,
+                     chunk_size=1024*1024, lexers=None):
+    """Writes the LaTeX block for file `path` to `out` without reading the
+    whole file into memory"""
+    import pygments
+    lexer = get_lexer_for_filename(path, lexers)
+    options = dict(lexer.options, stripnl=False)
+    lexer = type(lexer)(**options)
+    head, _, tail = blockfmt.partition('{content}')
+    out.write(head.format(path=filter_tex(path)))
+    f = open(path, 'r', errors='ignore')
+    try:
+        pygments.format(_stream_tokens(f, lexer, chunk_size), formatter, out)
+    finally:
+        f.close()
+    out.write(tail.format())
+
+
+_formatters = {}
+
+
+_caches = {}
+
+
+def _cpu_count():
+    import multiprocessing
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def _mp_context():
+    """Returns the multiprocessing context for worker processes.
+
+    Workers must not be forked directly, as walk() may be running threads.
+    forkserver forks them from a single-threaded server process instead.
+    Where it is unavailable, the default (spawn) does not fork at all.
+    """
+    import multiprocessing
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context()
+
+
+def _highlight_job(path, style, blockfmt, cache_dir, lexer_overrides,
+                   lexer_index_path):
+    """highlight() in a worker process. Formatters, caches and lexer indexes
+    are reused per process.
+
+    Returns (block, hit), where hit is None if `cache_dir` is None.
+    """
+    if style not in _formatters:
+        _formatters[style] = get_formatter(style)
+    lexers = get_lexer_index(lexer_overrides, lexer_index_path)
+    if cache_dir is None:
+        return highlight(path, _formatters[style], blockfmt,
+                         lexers=lexers), None
+    if cache_dir not in _caches:
+        _caches[cache_dir] = HighlightCache(cache_dir)
+    cache = _caches[cache_dir]
+    hits = cache.hits
+    block = highlight(path, _formatters[style], blockfmt, cache, lexers)
+    return block, cache.hits != hits
+
+
+def _should_stream(path, stream_threshold):
+    return (stream_threshold is not None and
+            os.path.getsize(path) >= stream_threshold)
+
+
+def highlight_parallel(paths, style='default', blockfmt=blockfmt, jobs=None,
+                       window=None, cache=None, stream_threshold=None,
+                       lexers=None):
+    """Yields (path, block) for `paths` in order, with blocks highlighted by
+    `jobs` worker processes.
+
+    At most `window` files are in flight at any time, so memory is bounded by
+    the window rather than the number of paths. Hits and misses of the
+    workers are recorded in `cache`. Files of at least `stream_threshold`
+    bytes are not highlighted; their block is None and should be written with
+    highlight_stream().
+    """
+    import collections
+    import concurrent.futures
+    if window is None:
+        window = 2 * (jobs or _cpu_count())
+    cache_dir = cache.path if cache is not None else None
+    if lexers is None:
+        lexers = get_lexer_index()
+
+    def result(item):
+        path, future = item
+        if future is None:
+            return path, None
+        block, hit = future.result()
+        if hit is not None:
+            if hit:
+                cache.hits += 1
+            else:
+                cache.misses += 1
+        return path, block
+
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs, mp_context=_mp_context())
+    pending = collections.deque()
+    try:
+        for path in paths:
+            if _should_stream(path, stream_threshold):
+                future = None
+            else:
+                future = executor.submit(_highlight_job, path, style,
+                                         blockfmt, cache_dir,
+                                         lexers.overrides, lexers.path)
+            pending.append((path, future))
+            if len(pending) >= window:
+                yield result(pending.popleft())
+        while pending:
+            yield result(pending.popleft())
+    finally:
+        for _, future in pending:
+            if future is not None:
+                future.cancel()
+        executor.shutdown()
+
+
+def _ignore_regex(pattern):
+    """Translates gitignore-style `pattern` into a regex matching paths
+    relative to the directory of the ignore file"""
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    out = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            out.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            out.append('[^/]')
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 2:]:
+            j = pattern.index(']', i + 2)
+            cls = pattern[i + 1:j]
+            if cls.startswith('!'):
+                cls = '^' + cls[1:]
+            out.append('[' + cls.replace('\\', '\\\\') + ']')
+            i = j + 1
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    prefix = '' if anchored else '(?:.*/)?'
+    return re.compile(prefix + ''.join(out) + '$')
+
+
+def parse_ignore(lines, base=''):
+    """Returns ignore rules for gitignore-style `lines` found in directory
+    `base`, as (base, regex, negate, dir_only) tuples"""
+    rules = []
+    for line in lines:
+        line = line.rstrip('\n').rstrip()
+        if not line or line.startswith('#'):
+            continue
+        negate = line.startswith('!')
+        if negate:
+            line = line[1:]
+        elif line.startswith('\\'):
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        if line:
+            rules.append((base, _ignore_regex(line), negate, dir_only))
+    return rules
+
+
+def is_ignored(path, is_dir, rules):
+    """Returns True if `path` is ignored by `rules`. The last matching rule
+    wins, as in git."""
+    ignored = False
+    for base, regex, negate, dir_only in rules:
+        if dir_only and not is_dir:
+            continue
+        # `path` is always below `base`, as rules are only inherited by
+        # subdirectories
+        rel = path[len(base):].lstrip(os.sep).replace(os.sep, '/')
+        if regex.match(rel):
+            ignored = not negate
+    return ignored
+
+
+def is_binary(path, size=8192):
+    """Returns True if the first `size` bytes of `path` contain a NUL byte"""
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return False
+    try:
+        return b'\0' in f.read(size)
+    finally:
+        f.close()
+
+
+def _scan_dir(path, gitignore):
+    """Returns (entries, ignore lines) of directory `path`, where entries
+    are sorted (name, path, is_dir) tuples"""
+    entries = []
+    lines = []
+    for x in os.scandir(path):
+        is_dir = x.is_dir(follow_symlinks=False)
+        if is_dir:
+            entries.append((x.name, x.path, True))
+        elif x.is_file():
+            if gitignore and x.name == '.gitignore':
+                f = open(x.path, 'r', errors='ignore')
+                lines = f.readlines()
+                f.close()
+            entries.append((x.name, x.path, False))
+    entries.sort()
+    return entries, lines
+
+
+def walk(paths, excludes=(), gitignore=True, jobs=8, onerror=None):
+    """Yields `paths`, with directories replaced by the text files under them.
+
+    Directories are walked in sorted depth-first order, skipping files and
+    directories matched by `excludes` (gitignore-style globs), by
+    .gitignore files if `gitignore` is True, and files which look binary.
+    Directory listings and binary sniffing of files which are not skipped
+    run ahead in `jobs` threads, and files are yielded as soon as they are
+    found. Directories which cannot be listed are skipped, after calling
+    `onerror` (if given) with the OSError, as os.walk() does.
+    """
+    import concurrent.futures
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+    pending = set()
+
+    def scan(path):
+        return _scan_dir(path, gitignore)
+
+    def submit(fn, path):
+        future = executor.submit(fn, path)
+        pending.add(future)
+        return future
+
+    def visit(path, future, rules):
+        try:
+            entries, lines = future.result()
+        except OSError as e:
+            if onerror is not None:
+                onerror(e)
+            return
+        finally:
+            pending.discard(future)
+        if lines:
+            rules = rules + parse_ignore(lines, path)
+        # Start listing subdirectories before descending into the first
+        entries = [(path, is_dir,
+                    submit(scan, path) if is_dir else submit(is_binary, path))
+                   for name, path, is_dir in entries
+                   if name != '.git' and not is_ignored(path, is_dir, rules)]
+        for path, is_dir, future in entries:
+            if is_dir:
+                for x in visit(path, future, rules):
+                    yield x
+            else:
+                binary = future.result()
+                pending.discard(future)
+                if not binary:
+                    yield path
+
+    try:
+        for path in paths:
+            if not os.path.isdir(path):
+                yield path
+                continue
+            rules = parse_ignore(excludes, path)
+            for x in visit(path, submit(scan, path), rules):
+                yield x
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def code2tex(out, paths, style='default', title='', author='',
+             headerfmt=headerfmt, footerfmt=footerfmt, blockfmt=blockfmt,
+             jobs=1, cache=None, stream_threshold=None, lexers=None):
+    """Formats `paths` into LaTeX
+
+    If `jobs` is not 1, files are highlighted in parallel by `jobs` worker
+    processes (or one per CPU if `jobs` is None or 0). If `cache` is a
+    HighlightCache, highlighted fragments are reused from it. Files of at
+    least `stream_threshold` bytes are streamed to `out` with
+    highlight_stream() instead. `lexers` is the LexerIndex used to find
+    lexers.
+    """
+    formatter = get_formatter(style)
     header = headerfmt.format(title=filter_tex(title),
                               author=filter_tex(author),
                               styledefs=formatter.get_style_defs())
     footer = footerfmt.format()
     out.write(header)
-    for path in paths:
-        lexer = get_lexer_for_filename(path)
-        f = open(path, 'r', errors='ignore')
-        contents = f.read()
-        f.close()
-        contents = pygments.highlight(contents, lexer, formatter)
-        contents = blockfmt.format(path=filter_tex(path), content=contents)
-        out.write(contents)
+    if jobs == 1:
+        blocks = ((path, None if _should_stream(path, stream_threshold)
+                   else highlight(path, formatter, blockfmt, cache, lexers))
+                  for path in paths)
+    else:
+        blocks = highlight_parallel(paths, style, blockfmt, jobs or None,
+                                    cache=cache,
+                                    stream_threshold=stream_threshold,
+                                    lexers=lexers)
+    for path, block in blocks:
+        if block is None:
+            highlight_stream(out, path, formatter, blockfmt, lexers=lexers)
+        else:
+            out.write(block)
     out.write(footer)
+    if cache is not None:
+        cache.evict()
+
+
+def lexer_mapping(x):
+    """Parses a GLOB=LEXER command line argument into (glob, lexer)"""
+    pattern, sep, alias = x.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError('invalid lexer mapping: '
+                                         '{0}'.format(x))
+    return pattern, alias
 
 
 def main(args=None, prog=None):
@@ -94,7 +730,30 @@ def main(args=None, prog=None):
     p.add_argument('-t', '--title', default=os.getcwd(), help='Document title')
     p.add_argument('-s', '--style', default='default', help='Formatting style')
     p.add_argument('--author', default='', help='Document author')
-    p.add_argument('paths', nargs='*')
+    p.add_argument('-j', '--jobs', type=int, default=1,
+                   help='Number of parallel jobs (0: one per CPU)')
+    p.add_argument('-C', '--cache', action='store_true', default=False,
+                   help='Reuse highlighted files from the highlight cache')
+    p.add_argument('--cache-dir', default=default_cache_dir(), metavar='DIR',
+                   help='Highlight cache directory')
+    p.add_argument('--cache-size', type=int, default=100, metavar='MB',
+                   help='Maximum highlight cache size in MB')
+    p.add_argument('--cache-stats', action='store_true', default=False,
+                   help='Print highlight cache statistics to stderr')
+    p.add_argument('--stream-threshold', type=int, default=16, metavar='MB',
+                   help='Stream files of at least this size instead of '
+                   'highlighting them in memory')
+    p.add_argument('-m', '--map', action='append', default=[],
+                   type=lexer_mapping, metavar='GLOB=LEXER', dest='lexer_map',
+                   help='Use lexer LEXER for files matching GLOB')
+    p.add_argument('-x', '--exclude', action='append', default=[],
+                   metavar='GLOB', help='Skip files and directories '
+                   'matching GLOB (gitignore syntax) in directories')
+    p.add_argument('--no-gitignore', dest='gitignore', action='store_false',
+                   default=True, help='Do not honor .gitignore files in '
+                   'directories')
+    p.add_argument('paths', nargs='*', help='Files, or directories to '
+                   'search for text files')
     args = p.parse_args(args)
     try:
         if args.liststyles:
@@ -102,8 +761,27 @@ def main(args=None, prog=None):
         else:
             if not args.paths:
                 p.error('the following arguments are required: paths')
-            code2tex(args.out, args.paths, style=args.style,
-                     title=args.title, author=args.author)
+            if args.cache:
+                cache = HighlightCache(args.cache_dir,
+                                       args.cache_size * 1024 * 1024)
+                lexers = get_lexer_index(args.lexer_map, os.path.join(
+                    args.cache_dir, 'lexers.json'))
+            else:
+                cache = None
+                lexers = get_lexer_index(args.lexer_map)
+
+            def warn(e):
+                print(prog, ': warning: ', e, sep='', file=sys.stderr)
+            paths = walk(args.paths, args.exclude, args.gitignore,
+                         onerror=warn)
+            code2tex(args.out, paths, style=args.style,
+                     title=args.title, author=args.author, jobs=args.jobs,
+                     cache=cache,
+                     stream_threshold=args.stream_threshold * 1024 * 1024,
+                     lexers=lexers)
+            if cache is not None and args.cache_stats:
+                print(prog, ': cache: ', cache.stats(), sep='',
+                      file=sys.stderr)
         return 0
     except Exception as e:
         print(prog, ': error: ', e, sep='', file=sys.stderr)
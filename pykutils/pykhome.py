@@ -9,11 +9,8 @@ import stat
 import subprocess
 import sys
 import re
-import urllib.request
-import tempfile
 import hashlib
 import glob
-import mako.template
 
 
 logger = logging.getLogger(__name__)
@@ -29,6 +26,7 @@ hometpl
 
 def update_hometpl(path, work_tree=None):
     """Update `path`. Warn if it is not gitignored"""
+    import mako.template
     if not work_tree:
         work_tree = homedir
     tpl = mako.template.Template(filename=path)
@@ -140,6 +138,7 @@ def write_cached_debian_packages(packages):
 
 
 def download_debian_packages(packages, dst=None):
+    import urllib.request
     if not dst:
         dst = os.path.join(homedir, '.cache', 'pykhome', 'debian')
     os.makedirs(dst, exist_ok=True)
@@ -1,11 +1,1224 @@
-import subprocess
+"""mirror websites
+
+By default a built-in concurrent engine is used, which mirrors like
+`wget -k -m -p -np -E`. Pass --wget, or any option the built-in engine does
+not know (e.g. -nH or --reject), to run wget with those options instead.
+"""
+import argparse
+import os
+import os.path
+import re
 import sys
 
 
+def _log():
+    """Returns the module logger. logging is only imported when needed."""
+    import logging
+    return logging.getLogger(__name__)
+
+
+wget_args = ['wget', '-k', '-m', '-p', '-np', '-E']
+
+
+"""
+URLs and local paths
+"""
+
+
+default_ports = {'http': 80, 'https': 443}
+
+
+def normalize_url(url):
+    """Returns `url` without fragment, with lowercased scheme and host, and
+    without default port"""
+    import urllib.parse
+    parts = urllib.parse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if ':' in host:
+        host = '[{0}]'.format(host)
+    port = parts.port
+    if port and port != default_ports.get(scheme):
+        host = '{0}:{1}'.format(host, port)
+    path = remove_dot_segments(parts.path or '/')
+    return urllib.parse.urlunsplit((scheme, host, path, parts.query, ''))
+
+
+def remove_dot_segments(path):
+    """Resolves '.' and '..' segments of URL `path`, including
+    percent-encoded ones (as browsers do)"""
+    import urllib.parse
+    out = []
+    segments = path.split('/')
+    for i, x in enumerate(segments):
+        x_ = urllib.parse.unquote(x)
+        last = i == len(segments) - 1
+        if x_ == '.':
+            if last:
+                out.append('')
+        elif x_ == '..':
+            if len(out) > 1:
+                out.pop()
+            if last:
+                out.append('')
+        else:
+            out.append(x)
+    return '/'.join(out) or '/'
+
+
+def split_fragment(url):
+    """Returns (url without fragment, '#fragment' or '')"""
+    url, sep, fragment = url.partition('#')
+    return url, sep + fragment
+
+
+def url_host(url):
+    """Returns (scheme, host, port) of `url`"""
+    import urllib.parse
+    parts = urllib.parse.urlsplit(url)
+    return (parts.scheme, parts.hostname,
+            parts.port or default_ports.get(parts.scheme))
+
+
+def parent_dir(url):
+    """Returns `url` up to and including the last '/' of its path"""
+    import urllib.parse
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path[:parts.path.rfind('/') + 1] or '/'
+    return urllib.parse.urlunsplit((parts.scheme, parts.netloc, path, '', ''))
+
+
+html_types = ('text/html', 'application/xhtml+xml')
+
+
+#: Characters which are not allowed in Windows file names
+windows_reserved_re = re.compile(r'[<>:"|?*\x00-\x1f]')
+
+
+def local_path(url, content_type=None, adjust_extension=True, windows=None):
+    """Returns path (relative to the mirror root) at which `url` is saved,
+    like wget -m. With `adjust_extension`, '.html' or '.css' is appended as
+    wget -E does.
+
+    With `windows` (the default on Windows), names are restricted as by
+    wget --restrict-file-names=windows: the port is separated by '+', the
+    query by '@', and other characters not allowed on Windows are
+    percent-encoded."""
+    import urllib.parse
+    if windows is None:
+        windows = os.name == 'nt'
+    parts = urllib.parse.urlsplit(url)
+    host = (parts.hostname or '').lower()
+    if windows:
+        host = host.replace(':', '+')
+    if parts.port and parts.port != default_ports.get(parts.scheme):
+        host = '{0}{1}{2}'.format(host, '+' if windows else ':', parts.port)
+    path = parts.path or '/'
+    if path.endswith('/'):
+        path += 'index.html'
+    # Decode segments before dropping '.' and '..', so that percent-encoded
+    # dot segments cannot escape the mirror directory
+    segments = [urllib.parse.unquote(x) for x in path.split('/')]
+    segments = [x.replace('/', '%2F').replace('\\', '%5C') for x in segments
+                if x not in ('', '.', '..')]
+    if not segments:
+        segments = ['index.html']
+    query = parts.query.replace('/', '%2F')
+    if windows:
+        segments = [windows_reserved_re.sub(_percent_encode, x)
+                    for x in segments]
+        query = windows_reserved_re.sub(_percent_encode, query)
+    if parts.query:
+        segments[-1] += ('@' if windows else '?') + query
+    name = segments[-1]
+    if adjust_extension:
+        if (content_type in html_types and
+                not re.search(r'\.html?$', name, re.IGNORECASE)):
+            segments[-1] += '.html'
+        elif (content_type == 'text/css' and
+              not re.search(r'\.css$', name, re.IGNORECASE)):
+            segments[-1] += '.css'
+    return os.path.join(host, *segments)
+
+
+def _percent_encode(m):
+    return ''.join('%{0:02X}'.format(x) for x in m.group(0).encode('utf-8'))
+
+
+def relative_url(path, start):
+    """Returns URL of local `path` relative to the directory of local page
+    `start`"""
+    import urllib.parse
+    rel = os.path.relpath(path, os.path.dirname(start))
+    return urllib.parse.quote(rel.replace(os.sep, '/'), safe='/:@!$&\'()*+,;=')
+
+
+"""
+Link extraction
+"""
+
+
+css_url_re = re.compile(r'''url\(\s*(?:"([^"]*)"|'([^']*)'|([^)\s'"]*))\s*\)'''
+                        r'''|@import\s+(?:"([^"]*)"|'([^']*)')''')
+
+
+def css_urls(text):
+    """Yields (start, end, url) of url() and @import references in CSS
+    `text`"""
+    for m in css_url_re.finditer(text):
+        for i in range(1, 6):
+            if m.group(i) is not None:
+                yield m.start(i), m.end(i), m.group(i)
+                break
+
+
+def srcset_urls(value):
+    """Returns URLs in srcset attribute `value`"""
+    urls = []
+    for x in value.split(','):
+        x = x.strip().split()
+        if x:
+            urls.append(x[0])
+    return urls
+
+
+#: (tag, attribute) -> whether the link is an inline page requisite
+link_attrs = {
+    ('a', 'href'): False,
+    ('area', 'href'): False,
+    ('audio', 'src'): True,
+    ('body', 'background'): True,
+    ('embed', 'src'): True,
+    ('frame', 'src'): True,
+    ('iframe', 'src'): True,
+    ('img', 'src'): True,
+    ('img', 'srcset'): True,
+    ('input', 'src'): True,
+    ('object', 'data'): True,
+    ('script', 'src'): True,
+    ('source', 'src'): True,
+    ('source', 'srcset'): True,
+    ('table', 'background'): True,
+    ('td', 'background'): True,
+    ('th', 'background'): True,
+    ('track', 'src'): True,
+    ('video', 'poster'): True,
+    ('video', 'src'): True,
+}
+
+
+inline_rels = {'stylesheet', 'icon', 'apple-touch-icon', 'preload',
+               'modulepreload', 'manifest'}
+
+
+class LinkParser(object):
+    """Collects links from an HTML document.
+
+    Links are appended to `links` as (url, inline) pairs, where `url` is
+    absolute. If `record` is True, links are also recorded in `tags` as
+    (pos, starttag text, [attr]) and `styles` as (pos, text), which
+    convert_html() uses to rewrite them.
+
+    Wraps an html.parser.HTMLParser (rather than subclassing it) so that
+    html.parser is only imported when a page is parsed.
+    """
+
+    def __init__(self, base, record=False):
+        import html.parser
+        self._parser = html.parser.HTMLParser(convert_charrefs=True)
+        for name in ('handle_starttag', 'handle_startendtag',
+                     'handle_endtag', 'handle_data'):
+            setattr(self._parser, name, getattr(self, name))
+        self.base = base
+        self.record = record
+        self.links = []
+        self.tags = []
+        self.styles = []
+        self._in_style = False
+
+    def feed(self, data):
+        self._parser.feed(data)
+
+    def close(self):
+        self._parser.close()
+
+    def _add(self, url, inline):
+        import urllib.parse
+        url = url.strip()
+        if not url or url.startswith('#'):
+            return
+        self.links.append((urllib.parse.urljoin(self.base, url), inline))
+
+    def handle_starttag(self, tag, attrs):
+        import urllib.parse
+        attrs = [(k, v) for k, v in attrs if v is not None]
+        if tag == 'base':
+            for k, v in attrs:
+                if k == 'href':
+                    self.base = urllib.parse.urljoin(self.base, v)
+            return
+        if tag == 'style':
+            self._in_style = True
+        found = []
+        for k, v in attrs:
+            if k == 'style':
+                for _, _, url in css_urls(v):
+                    self._add(url, True)
+                found.append(k)
+            elif tag == 'link' and k == 'href':
+                rels = dict(attrs).get('rel', '').lower().split()
+                self._add(v, bool(inline_rels.intersection(rels)))
+                found.append(k)
+            elif (tag, k) in link_attrs:
+                inline = link_attrs[tag, k]
+                if k == 'srcset':
+                    for url in srcset_urls(v):
+                        self._add(url, inline)
+                else:
+                    self._add(v, inline)
+                found.append(k)
+        if self.record and found:
+            self.tags.append((self._parser.getpos(),
+                              self._parser.get_starttag_text(), found))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        self._in_style = False
+
+    def handle_endtag(self, tag):
+        if tag == 'style':
+            self._in_style = False
+
+    def handle_data(self, data):
+        if not self._in_style:
+            return
+        for _, _, url in css_urls(data):
+            self._add(url, True)
+        if self.record:
+            self.styles.append((self._parser.getpos(), data))
+
+
+class CSSScanner(object):
+    """Incrementally collects url() and @import links from CSS, with the
+    same interface as LinkParser"""
+
+    def __init__(self, base):
+        self.base = base
+        self.links = []
+        self._buf = ''
+
+    def _scan(self, text):
+        import urllib.parse
+        for _, _, url in css_urls(text):
+            url = url.strip()
+            if url and not url.startswith('#'):
+                self.links.append((urllib.parse.urljoin(self.base, url),
+                                   True))
+
+    def feed(self, data):
+        # Only scan up to the last complete line or declaration, as a link
+        # may be split across chunks
+        text = self._buf + data
+        i = max(text.rfind('\n'), text.rfind(';'), text.rfind('}'))
+        self._scan(text[:i + 1])
+        self._buf = text[i + 1:]
+
+    def close(self):
+        self._scan(self._buf)
+        self._buf = ''
+
+
+"""
+Link conversion
+"""
+
+
+def _line_offsets(text):
+    offsets = [0]
+    i = text.find('\n')
+    while i != -1:
+        offsets.append(i + 1)
+        i = text.find('\n', i + 1)
+    return offsets
+
+
+def _attr_re(name):
+    return re.compile(r'''(\s{0}\s*=\s*)("[^"]*"|'[^']*'|[^\s"'>]+)'''
+                      .format(re.escape(name)), re.IGNORECASE)
+
+
+def _convert_css(text, base, convert):
+    import urllib.parse
+    out = []
+    last = 0
+    for start, end, url in css_urls(text):
+        if not url.strip() or url.strip().startswith('#'):
+            continue
+        out.append(text[last:start])
+        out.append(convert(urllib.parse.urljoin(base, url.strip())))
+        last = end
+    out.append(text[last:])
+    return ''.join(out)
+
+
+def _convert_attr(tag, name, base, convert):
+    import html
+    import urllib.parse
+
+    def sub(m):
+        quoted = m.group(2)
+        if quoted[:1] in ('"', "'"):
+            q, value = quoted[0], quoted[1:-1]
+        else:
+            q, value = '"', quoted
+        value = html.unescape(value)
+        if name == 'style':
+            value = _convert_css(value, base, convert)
+        elif name == 'srcset':
+            candidates = []
+            for x in value.split(','):
+                x = x.strip().split(None, 1)
+                if x:
+                    x[0] = convert(urllib.parse.urljoin(base, x[0]))
+                    candidates.append(' '.join(x))
+            value = ', '.join(candidates)
+        elif value.strip() and not value.strip().startswith('#'):
+            value = convert(urllib.parse.urljoin(base, value.strip()))
+        return m.group(1) + q + html.escape(value, quote=True) + q
+    return _attr_re(name).sub(sub, tag, count=1)
+
+
+def convert_html(text, base, convert):
+    """Returns HTML `text` with every link passed through `convert`, which
+    takes an absolute URL and returns the URL to write"""
+    parser = LinkParser(base, record=True)
+    parser.feed(text)
+    parser.close()
+    lines = _line_offsets(text)
+    edits = []
+    for (lineno, col), tag, attrs in parser.tags:
+        start = lines[lineno - 1] + col
+        new = tag
+        for name in attrs:
+            new = _convert_attr(new, name, parser.base, convert)
+        edits.append((start, start + len(tag), new))
+    for (lineno, col), data in parser.styles:
+        start = lines[lineno - 1] + col
+        edits.append((start, start + len(data),
+                      _convert_css(data, parser.base, convert)))
+    edits.sort()
+    out = []
+    last = 0
+    for start, end, new in edits:
+        out.append(text[last:start])
+        out.append(new)
+        last = end
+    out.append(text[last:])
+    return ''.join(out)
+
+
+def convert_css(text, base, convert):
+    """Returns CSS `text` with every link passed through `convert`"""
+    return _convert_css(text, base, convert)
+
+
+"""
+HTTP
+"""
+
+
+class ConnectionPool(object):
+    """Keep-alive HTTP(S) connections, pooled per (scheme, host, port)"""
+
+    def __init__(self, timeout=30, max_idle=4):
+        import threading
+        self.timeout = timeout
+        #: Maximum idle connections kept per host
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns (connection, reused) for `key`"""
+        with self._lock:
+            conns = self._idle.get(key)
+            if conns:
+                return conns.pop(), True
+        return self.connect(key), False
+
+    def connect(self, key):
+        """Returns a new connection for `key`, bypassing the pool"""
+        import http.client
+        scheme, host, port = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port,
+                                               timeout=self.timeout)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def put(self, key, conn):
+        """Returns `conn` to the pool"""
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.max_idle:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.close()
+            self._idle.clear()
+
+
+user_agent = 'pykutils-wgetmirror'
+
+
+def _content_type(resp):
+    """Returns (media type, charset) of response `resp`"""
+    value = resp.getheader('Content-Type', '')
+    media, _, params = value.partition(';')
+    m = re.search(r'charset\s*=\s*"?([^";\s]+)', params, re.IGNORECASE)
+    return media.strip().lower(), m.group(1) if m else None
+
+
+def _file_mode():
+    """Returns the mode of newly created files, as tempfile creates files
+    readable by the owner only"""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def _charset(charset):
+    import codecs
+    try:
+        return codecs.lookup(charset or 'utf-8').name
+    except LookupError:
+        return 'utf-8'
+
+
+"""
+Manifest
+"""
+
+
+manifest_name = '.wgetmirror.json'
+
+
+class Manifest(object):
+    """Persistent record of a mirror, stored as JSON at `path`.
+
+    `entries` maps each mirrored URL to a dict with its local `path`, `etag`,
+    `last_modified`, `size`, `sha256`, `media` type, `charset`, outgoing
+    `links` as [url, inline] pairs and, for converted pages, `resolved`, a
+    hash of where those links pointed when the page was last converted.
+    `redirects` maps redirected URLs to their targets.
+    """
+
+    version = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.redirects = {}
+
+    def load(self):
+        """Loads the manifest, if it exists and is readable"""
+        import json
+        try:
+            f = open(self.path, 'r', encoding='utf-8')
+        except IOError:
+            return
+        try:
+            data = json.load(f)
+        except ValueError:
+            _log().warning('%s: ignoring corrupt manifest', self.path)
+            return
+        finally:
+            f.close()
+        if data.get('version') != self.version:
+            return
+        self.entries = data['entries']
+        self.redirects = data['redirects']
+
+    def save(self):
+        import json
+        import tempfile
+        data = {'version': self.version, 'entries': self.entries,
+                'redirects': self.redirects}
+        dirname = os.path.dirname(self.path) or '.'
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=dirname, prefix='.',
+                                       suffix='.part')
+        f = open(fd, 'w', encoding='utf-8')
+        json.dump(data, f, separators=(',', ':'))
+        f.close()
+        os.replace(tmppath, self.path)
+
+
+"""
+Object store
+"""
+
+
+objects_name = '.wgetmirror-objects'
+
+
+def _clone(src, dst):
+    """Copies file `src` to `dst`, as a reflink if the filesystem supports
+    it"""
+    import shutil
+    try:
+        import fcntl
+        ficlone = 0x40049409
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), ficlone, fsrc.fileno())
+        return
+    except (ImportError, OSError):
+        pass
+    shutil.copyfile(src, dst)
+
+
+class ObjectStore(object):
+    """Content-addressed store of response bodies at `path`.
+
+    Each unique body is stored once, named by its SHA-256, and hardlinked
+    (or reflinked, or copied if neither is possible) into the mirror tree.
+    Files in the tree must therefore be replaced, never modified in place.
+    """
+
+    def __init__(self, path):
+        import threading
+        self.path = path
+        #: Number of bodies which were already in the store
+        self.hits = 0
+        #: Bytes not written because bodies were already in the store
+        self.saved = 0
+        #: Number and bytes of unreferenced objects removed by gc()
+        self.removed = 0
+        self.removed_bytes = 0
+        self._lock = threading.Lock()
+
+    def object_path(self, digest):
+        return os.path.join(self.path, digest[:2], digest[2:])
+
+    def add(self, tmppath, digest, dst):
+        """Moves file `tmppath` with SHA-256 `digest` into the store (or
+        discards it if the store already has it), and links it to `dst`"""
+        obj = self.object_path(digest)
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        if os.path.exists(obj):
+            size = os.path.getsize(tmppath)
+            os.unlink(tmppath)
+            # Nothing is saved if `dst` already is this object (e.g. /docs/
+            # and /docs/index.html, or an unchanged file)
+            if not (os.path.exists(dst) and os.path.samefile(obj, dst)):
+                with self._lock:
+                    self.hits += 1
+                    self.saved += size
+        else:
+            os.replace(tmppath, obj)
+        self.link(digest, dst)
+
+    def link(self, digest, dst):
+        """Replaces `dst` with a link to object `digest`"""
+        import tempfile
+        obj = self.object_path(digest)
+        if os.path.exists(dst) and os.path.samefile(obj, dst):
+            return
+        fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(dst), prefix='.',
+                                       suffix='.part')
+        os.close(fd)
+        os.unlink(tmppath)
+        try:
+            os.link(obj, tmppath)
+        except OSError:
+            _clone(obj, tmppath)
+        os.replace(tmppath, dst)
+
+    def gc(self, keep):
+        """Removes objects whose digest is not in `keep`"""
+        try:
+            prefixes = os.listdir(self.path)
+        except FileNotFoundError:
+            return
+        for prefix in prefixes:
+            dirname = os.path.join(self.path, prefix)
+            if len(prefix) != 2 or not os.path.isdir(dirname):
+                continue
+            for name in os.listdir(dirname):
+                if prefix + name in keep:
+                    continue
+                obj = os.path.join(dirname, name)
+                size = os.path.getsize(obj)
+                os.unlink(obj)
+                self.removed += 1
+                self.removed_bytes += size
+            try:
+                os.rmdir(dirname)
+            except OSError:
+                pass
+
+
+"""
+Mirroring engine
+"""
+
+
+class Mirror(object):
+    """Concurrent website mirror, like `wget -k -m -p -np -E`.
+
+    URLs are fetched by `jobs` threads, with at most `per_host` requests in
+    flight per host. Responses are streamed to disk under `dst` and scanned
+    for links as they arrive. Links are followed on the hosts of `urls` only
+    and, with `no_parent`, only below the directories of `urls`; with
+    `page_requisites`, inline links (images, stylesheets, scripts...) are
+    fetched even outside those directories. With `convert_links`, links in
+    downloaded pages are rewritten to point to the local copies once
+    everything has been fetched.
+
+    With `manifest`, a Manifest is kept in `dst`. On later runs, files
+    listed in it are requested with If-None-Match/If-Modified-Since, and
+    unchanged pages are neither re-parsed nor re-converted.
+
+    With `dedupe`, bodies are kept in an ObjectStore in `dst`, so that
+    identical files are stored once. Objects no longer referenced by the
+    manifest are removed at the end of each run.
+    """
+
+    def __init__(self, urls, dst='.', jobs=8, per_host=2,
+                 page_requisites=True, no_parent=True, adjust_extension=True,
+                 convert_links=True, robots=True, timeout=30,
+                 chunk_size=64*1024, manifest=True, dedupe=False):
+        import threading
+        if jobs < 1 or per_host < 1:
+            raise ValueError('jobs and per_host must be at least 1')
+        self.urls = [normalize_url(x) for x in urls]
+        self.dst = dst
+        self.jobs = jobs
+        self.per_host = per_host
+        self.page_requisites = page_requisites
+        self.no_parent = no_parent
+        self.adjust_extension = adjust_extension
+        self.convert_links = convert_links
+        self.robots = robots
+        self.chunk_size = chunk_size
+        self.file_mode = _file_mode()
+        self.pool = ConnectionPool(timeout, per_host)
+        #: Normalized URL -> local path (relative to dst) of downloaded files
+        self.files = {}
+        #: Normalized URL -> normalized redirect target
+        self.redirects = {}
+        #: Local path -> (url, media type, charset) of pages to convert
+        self.documents = {}
+        #: Local paths of pages that were not modified since the last run
+        self.unchanged = set()
+        #: Previous run's manifest, and this run's
+        self.old_manifest = Manifest(os.path.join(dst, manifest_name))
+        self.manifest = Manifest(os.path.join(dst, manifest_name))
+        self.use_manifest = manifest
+        if manifest:
+            self.old_manifest.load()
+        if dedupe:
+            self.objects = ObjectStore(os.path.join(dst, objects_name))
+        else:
+            self.objects = None
+        self.not_modified = 0
+        self.errors = 0
+        self.bytes = 0
+        self._hosts = set(url_host(x) for x in self.urls)
+        self._parents = [parent_dir(x) for x in self.urls]
+        self._seen = set()
+        self._lock = threading.Lock()
+        self._host_slots = {}
+        self._robots = {}
+
+    def accept(self, url, inline=False):
+        """Returns True if `url` should be mirrored"""
+        scheme, host, port = url_host(url)
+        if scheme not in default_ports or (scheme, host, port) not in \
+                self._hosts:
+            return False
+        if self.no_parent and not (inline and self.page_requisites):
+            if not any(url.startswith(x) for x in self._parents):
+                return False
+        if self.robots and not self._robots_allowed(url):
+            return False
+        return True
+
+    def _robots_allowed(self, url):
+        rp = self._robots.get(url_host(url))
+        return rp is None or rp.can_fetch(user_agent, url)
+
+    def _read_robots(self, url):
+        """Fetches robots.txt of the host of `url`"""
+        import urllib.error
+        import urllib.parse
+        import urllib.request
+        import urllib.robotparser
+        parts = urllib.parse.urlsplit(url)
+        robots_url = urllib.parse.urlunsplit((parts.scheme, parts.netloc,
+                                              '/robots.txt', '', ''))
+        rp = urllib.robotparser.RobotFileParser(robots_url)
+        req = urllib.request.Request(robots_url,
+                                     headers={'User-Agent': user_agent})
+        # Like RobotFileParser.read(), but honouring the network timeout
+        try:
+            with urllib.request.urlopen(req, timeout=self.pool.timeout) as f:
+                rp.parse(f.read().decode('utf-8', 'replace').splitlines())
+        except urllib.error.HTTPError as e:
+            if e.code in (401, 403):
+                rp.disallow_all = True
+            else:
+                rp.allow_all = True
+        except (OSError, ValueError):
+            rp.allow_all = True
+        self._robots[url_host(url)] = rp
+
+    def _enqueue(self, queue, url, inline=False):
+        if queue is None:
+            return
+        url = normalize_url(url)
+        # Only accepted URLs are marked as seen: a URL rejected as a link may
+        # still be accepted later as an inline page requisite
+        if not self.accept(url, inline):
+            return
+        with self._lock:
+            if url in self._seen:
+                return
+            self._seen.add(url)
+        queue.put(url)
+
+    def _host_slot(self, key):
+        import threading
+        with self._lock:
+            if key not in self._host_slots:
+                self._host_slots[key] = threading.BoundedSemaphore(
+                    self.per_host)
+            return self._host_slots[key]
+
+    def _request(self, url, headers=None):
+        """Returns (key, connection, response) for GET `url`"""
+        import http.client
+        import urllib.parse
+        key = url_host(url)
+        parts = urllib.parse.urlsplit(url)
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+        headers = dict(headers or {}, **{'User-Agent': user_agent,
+                                         'Accept-Encoding': 'identity'})
+        conn, reused = self.pool.get(key)
+        try:
+            conn.request('GET', target, headers=headers)
+            return key, conn, conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            if not reused:
+                raise
+        # A reused keep-alive connection may have been closed by the server.
+        # Other idle connections to the host may be stale too, so retry on a
+        # new one.
+        conn = self.pool.connect(key)
+        conn.request('GET', target, headers=headers)
+        return key, conn, conn.getresponse()
+
+    def _conditional_headers(self, url):
+        """Returns validators of the previous copy of `url`, if any"""
+        entry = self.old_manifest.entries.get(url)
+        if entry is None or not os.path.exists(os.path.join(self.dst,
+                                                            entry['path'])):
+            return {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def _not_modified(self, url, queue):
+        """Reuses the previous copy of `url`"""
+        entry = self.old_manifest.entries[url]
+        with self._lock:
+            self.files[url] = entry['path']
+            self.manifest.entries[url] = entry
+            self.not_modified += 1
+            if entry['media'] in html_types or entry['media'] == 'text/css':
+                self.documents[entry['path']] = (url, entry['media'],
+                                                 entry['charset'])
+                self.unchanged.add(entry['path'])
+        for link, inline in entry['links']:
+            self._enqueue(queue, link, inline)
+        _log().info('%s: not modified', url)
+
+    def fetch(self, url, queue, conditional=True):
+        """Downloads `url`, and enqueues the links found in it.
+
+        If `conditional`, the previous copy of `url` is reused if the server
+        reports that it has not been modified.
+        """
+        import email.utils
+        import hashlib
+        import tempfile
+        import urllib.parse
+        headers = self._conditional_headers(url) if conditional else {}
+        key, conn, resp = self._request(url, headers)
+        try:
+            if resp.status == 304 and headers:
+                resp.read()
+                self._not_modified(url, queue)
+                return
+            if resp.status in (301, 302, 303, 307, 308):
+                resp.read()
+                location = resp.getheader('Location')
+                if location:
+                    target = normalize_url(urllib.parse.urljoin(url,
+                                                                location))
+                    with self._lock:
+                        self.redirects[url] = target
+                    self._enqueue(queue, target, True)
+                return
+            if resp.status != 200:
+                resp.read()
+                _log().warning('%s: %d %s', url, resp.status, resp.reason)
+                with self._lock:
+                    self.errors += 1
+                return
+            media, charset = _content_type(resp)
+            path = local_path(url, media, self.adjust_extension)
+            fullpath = os.path.join(self.dst, path)
+            dst = os.path.abspath(self.dst)
+            if os.path.commonpath([dst, os.path.abspath(fullpath)]) != dst:
+                raise ValueError('refusing to write {0} outside {1}'
+                                 .format(path, self.dst))
+            os.makedirs(os.path.dirname(fullpath), exist_ok=True)
+            if media in html_types:
+                scanner = LinkParser(url)
+            elif media == 'text/css':
+                scanner = CSSScanner(url)
+            else:
+                scanner = None
+            if scanner is not None:
+                import codecs
+                charset = _charset(charset)
+                decoder = codecs.getincrementaldecoder(charset)('replace')
+            links = []
+            size = 0
+            m = hashlib.sha256()
+            fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(fullpath),
+                                           prefix='.', suffix='.part')
+            try:
+                with open(fd, 'wb') as f:
+                    while True:
+                        buf = resp.read(self.chunk_size)
+                        if not buf:
+                            break
+                        f.write(buf)
+                        m.update(buf)
+                        size += len(buf)
+                        if scanner is not None:
+                            scanner.feed(decoder.decode(buf))
+                            for link, inline in scanner.links:
+                                self._enqueue(queue, link, inline)
+                            links.extend(scanner.links)
+                            del scanner.links[:]
+                os.chmod(tmppath, self.file_mode)
+                # Set on the new file before it is stored: with dedupe, the
+                # mtime of a shared object is that of its first download
+                last_modified = resp.getheader('Last-Modified')
+                if last_modified:
+                    try:
+                        mtime = email.utils.parsedate_to_datetime(
+                            last_modified).timestamp()
+                        os.utime(tmppath, (mtime, mtime))
+                    except (TypeError, ValueError, OverflowError):
+                        pass
+                if self.objects is not None:
+                    self.objects.add(tmppath, m.hexdigest(), fullpath)
+                else:
+                    os.replace(tmppath, fullpath)
+            except:
+                if os.path.exists(tmppath):
+                    os.unlink(tmppath)
+                raise
+            if scanner is not None:
+                scanner.feed(decoder.decode(b'', True))
+                scanner.close()
+                for link, inline in scanner.links:
+                    self._enqueue(queue, link, inline)
+                links.extend(scanner.links)
+            entry = {'path': path, 'etag': resp.getheader('ETag'),
+                     'last_modified': last_modified, 'size': size,
+                     'sha256': m.hexdigest(), 'media': media,
+                     'charset': charset, 'links': links}
+            with self._lock:
+                self.files[url] = path
+                self.manifest.entries[url] = entry
+                self.bytes += size
+                if scanner is not None:
+                    self.documents[path] = (url, media, charset)
+                    self.unchanged.discard(path)
+            _log().info('%s -> %s', url, path)
+        finally:
+            if resp.will_close or not resp.isclosed():
+                conn.close()
+            else:
+                self.pool.put(key, conn)
+
+    def _worker(self, queue):
+        while True:
+            url = queue.get()
+            if url is None:
+                queue.task_done()
+                return
+            try:
+                with self._host_slot(url_host(url)):
+                    self.fetch(url, queue)
+            except Exception as e:
+                _log().warning('%s: %s', url, e)
+                with self._lock:
+                    self.errors += 1
+            finally:
+                queue.task_done()
+
+    def resolve(self, url):
+        """Returns local path of `url`, following redirects, or None"""
+        url = normalize_url(url)
+        for _ in range(20):
+            if url in self.files:
+                return self.files[url]
+            if url not in self.redirects:
+                return None
+            url = self.redirects[url]
+        return None
+
+    def _converter(self, page):
+        def convert(url):
+            url, fragment = split_fragment(url)
+            path = self.resolve(url)
+            if path is None:
+                return url + fragment
+            return relative_url(path, page) + fragment
+        return convert
+
+    def _resolution(self, links):
+        """Returns hash of where `links` point to after link conversion"""
+        import hashlib
+        resolved = sorted(set((url, self.resolve(split_fragment(url)[0]))
+                              for url, _ in links))
+        return hashlib.sha256(repr(resolved).encode('utf-8')).hexdigest()
+
+    def _restore(self, entry):
+        """Restores the original body of `entry` from the object store.
+        Returns True on success."""
+        if self.objects is None:
+            return False
+        digest = entry['sha256']
+        if not os.path.exists(self.objects.object_path(digest)):
+            return False
+        self.objects.link(digest, os.path.join(self.dst, entry['path']))
+        return True
+
+    def dedupe_report(self):
+        """Returns (files, bytes, disk bytes) of the mirror: the number and
+        total size of files in the tree, and the size of the distinct inodes
+        of the tree and the object store together.
+
+        This is measured on the filesystem, since converted pages are not
+        links to their objects (the store keeps their original bodies for
+        restoring them). Copies made when the filesystem supports neither
+        hardlinks nor reflinks are counted in full, as are reflinks.
+        """
+        inodes = {}
+        files = size = 0
+        # Several URLs may be saved to the same local path
+        paths = set(x['path'] for x in self.manifest.entries.values())
+        for path in paths:
+            try:
+                st = os.stat(os.path.join(self.dst, path))
+            except FileNotFoundError:
+                continue
+            files += 1
+            size += st.st_size
+            inodes[st.st_dev, st.st_ino] = st.st_size
+        if self.objects is not None and os.path.isdir(self.objects.path):
+            for dirpath, _, filenames in os.walk(self.objects.path):
+                for name in filenames:
+                    st = os.stat(os.path.join(dirpath, name))
+                    inodes[st.st_dev, st.st_ino] = st.st_size
+        return files, size, sum(inodes.values())
+
+    def convert(self):
+        """Rewrites links in downloaded pages to point to local copies, or to
+        absolute URLs if they were not downloaded.
+
+        Unchanged pages whose links still point to the same places are
+        skipped. If they point elsewhere, the original page is restored from
+        the object store, or downloaded again if there is none.
+        """
+        import tempfile
+        for path, (url, media, charset) in list(self.documents.items()):
+            entry = self.manifest.entries[url]
+            resolved = self._resolution(entry['links'])
+            if path in self.unchanged:
+                if entry.get('resolved') == resolved:
+                    continue
+                if not self._restore(entry):
+                    try:
+                        self.fetch(url, None, conditional=False)
+                    except Exception as e:
+                        _log().warning('%s: %s', url, e)
+                        self.errors += 1
+                    if path in self.unchanged:
+                        # Could not download it again, keep the old copy
+                        continue
+                    self.not_modified -= 1
+                    entry = self.manifest.entries[url]
+                    resolved = self._resolution(entry['links'])
+            fullpath = os.path.join(self.dst, path)
+            f = open(fullpath, 'r', encoding=charset, errors='surrogateescape',
+                     newline='')
+            text = f.read()
+            f.close()
+            convert = self._converter(path)
+            if media in html_types:
+                new = convert_html(text, url, convert)
+            else:
+                new = convert_css(text, url, convert)
+            entry['resolved'] = resolved
+            if new == text:
+                continue
+            # Write a new file rather than modifying it in place, as it may
+            # be linked to the object store
+            st = os.stat(fullpath)
+            fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(fullpath),
+                                           prefix='.', suffix='.part')
+            f = open(fd, 'w', encoding=charset, errors='surrogateescape',
+                     newline='')
+            f.write(new)
+            f.close()
+            os.chmod(tmppath, st.st_mode)
+            os.utime(tmppath, (st.st_atime, st.st_mtime))
+            os.replace(tmppath, fullpath)
+
+    def run(self):
+        """Mirrors `urls`"""
+        import queue
+        import threading
+        if self.robots:
+            for url in self.urls:
+                if url_host(url) not in self._robots:
+                    self._read_robots(url)
+        q = queue.Queue()
+        threads = [threading.Thread(target=self._worker, args=(q,))
+                   for _ in range(self.jobs)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        try:
+            try:
+                for url in self.urls:
+                    with self._lock:
+                        self._seen.add(url)
+                    q.put(url)
+                q.join()
+            finally:
+                for _ in threads:
+                    q.put(None)
+            if self.convert_links:
+                # May download unchanged pages again
+                self.convert()
+        finally:
+            self.pool.close()
+        if self.use_manifest:
+            self.manifest.redirects = self.redirects
+            self.manifest.save()
+        if self.objects is not None:
+            self.objects.gc(set(x['sha256'] for x in
+                                self.manifest.entries.values()))
+
+
+def mirror(urls, dst='.', **kwargs):
+    """Mirrors `urls` into `dst`. Returns the Mirror."""
+    m = Mirror(urls, dst, **kwargs)
+    m.run()
+    return m
+
+
 def main(args=None, prog=None):
+    """Main entry point"""
+    import logging
+    import subprocess
     if args is None:
         args = sys.argv[1:]
-    return subprocess.call(['wget', '-k', '-m', '-p', '-np', '-E'] + args)
+    p = argparse.ArgumentParser(prog=prog, description='Mirrors websites '
+                                'like wget -k -m -p -np -E. Unrecognized '
+                                'options are passed to wget, which is run '
+                                'instead of the built-in engine.',
+                                allow_abbrev=False)
+    p.add_argument('--wget', action='store_true', default=False,
+                   help='Run wget instead of the built-in engine. Other '
+                   'arguments are passed to wget.')
+    p.add_argument('-P', '--directory-prefix', default='.', dest='dst',
+                   metavar='DIR', help='Save files under DIR')
+    p.add_argument('-j', '--jobs', type=int, default=8,
+                   help='Number of concurrent downloads')
+    p.add_argument('--per-host', type=int, default=2, metavar='N',
+                   help='Maximum concurrent downloads per host')
+    p.add_argument('-T', '--timeout', type=float, default=30,
+                   help='Network timeout in seconds')
+    p.add_argument('--no-robots', dest='robots', action='store_false',
+                   default=True, help='Ignore robots.txt')
+    p.add_argument('--no-manifest', dest='manifest', action='store_false',
+                   default=True, help='Do not keep a manifest for '
+                   'incremental re-mirroring')
+    p.add_argument('--dedupe', action='store_true', default=False,
+                   help='Store identical files once, hardlinked into the '
+                   'mirror')
+    p.add_argument('-v', '--verbose', action='store_true', default=False,
+                   help='Log every downloaded file')
+    p.add_argument('urls', nargs='*', metavar='URL')
+    wget = [x for x in args if x != '--wget']
+    args, rest = p.parse_known_args(args)
+    if args.wget or rest:
+        return subprocess.call(wget_args + wget)
+    if not args.urls:
+        p.error('the following arguments are required: URL')
+    if args.jobs < 1:
+        p.error('--jobs must be at least 1')
+    if args.per_host < 1:
+        p.error('--per-host must be at least 1')
+    logging.basicConfig(format='%(message)s',
+                        level=logging.INFO if args.verbose else
+                        logging.WARNING)
+    try:
+        m = mirror(args.urls, args.dst, jobs=args.jobs,
+                   per_host=args.per_host, timeout=args.timeout,
+                   robots=args.robots, manifest=args.manifest,
+                   dedupe=args.dedupe)
+    except KeyboardInterrupt:
+        return 1
+    except Exception as e:
+        print(prog, ': error: ', e, sep='', file=sys.stderr)
+        return 1
+    print(prog, ': mirrored ', len(m.files), ' files (', m.not_modified,
+          ' not modified), downloaded ', m.bytes, ' bytes', sep='',
+          file=sys.stderr)
+    if m.objects is not None:
+        files, size, disk = m.dedupe_report()
+        saved = ('{0} saved'.format(size - disk) if size > disk else
+                 'nothing saved')
+        print(prog, ': dedupe: ', m.objects.saved, ' bytes not written; ',
+              files, ' files, ', size, ' bytes use ', disk,
+              ' bytes with the object store (', saved, ')', sep='',
+              file=sys.stderr)
+        if m.objects.removed:
+            print(prog, ': dedupe: removed ', m.objects.removed,
+                  ' unreferenced objects (', m.objects.removed_bytes,
+                  ' bytes)', sep='', file=sys.stderr)
+    return 1 if m.errors else 0
 
 
 if __name__ == '__main__':
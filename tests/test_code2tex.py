@@ -0,0 +1,409 @@
+import contextlib
+import io
+import os
+import os.path
+import shutil
+import subprocess
+import tempfile
+import unittest
+import unittest.mock
+
+import pykutils.code2tex
+
+
+class TestMain(unittest.TestCase):
+    def test_invalid_lexer_mapping(self):
+        with self.assertRaises(SystemExit) as cm, \
+                contextlib.redirect_stderr(io.StringIO()) as stderr:
+            pykutils.code2tex.main(['-m', 'foo', 'x'], 'code2tex')
+        self.assertEqual(cm.exception.code, 2)
+        self.assertIn('invalid lexer mapping: foo', stderr.getvalue())
+
+    def test_lexer_mapping(self):
+        self.assertEqual(pykutils.code2tex.lexer_mapping('*.h=c'),
+                         ('*.h', 'c'))
+        self.assertEqual(pykutils.code2tex.lexer_mapping('a=b=c'),
+                         ('a', 'b=c'))
+
+
+class TreeTestCase(unittest.TestCase):
+    """Creates `files` (path -> bytes) in a temporary directory"""
+
+    files = {}
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for path, data in self.files.items():
+            path = self.path(path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def path(self, path):
+        return os.path.join(self.root, *path.split('/'))
+
+    def walk(self, *args, **kwargs):
+        return [os.path.relpath(x, self.root).replace(os.sep, '/')
+                for x in pykutils.code2tex.walk([self.root], *args, **kwargs)]
+
+
+class TestIgnore(unittest.TestCase):
+    def test_parse_ignore(self):
+        lines = ['# comment\n', '\n', '*.log  \n', '!keep.log\n',
+                 '\\#hash\n', 'build/\n', '/\n']
+        rules = pykutils.code2tex.parse_ignore(lines, 'base')
+        self.assertEqual([(base, negate, dir_only) for base, _, negate,
+                          dir_only in rules],
+                         [('base', False, False), ('base', True, False),
+                          ('base', False, False), ('base', False, True)])
+        self.assertTrue(rules[2][1].match('#hash'))
+
+    def test_is_ignored(self):
+        tests = [
+            # (patterns, path, is_dir, ignored)
+            (['*.log'], 'x.log', False, True),
+            (['*.log'], 'a/b/x.log', False, True),
+            (['*.log'], 'x.logs', False, False),
+            (['*.log', '!keep.log'], 'keep.log', False, False),
+            (['!keep.log', '*.log'], 'keep.log', False, True),
+            (['/build'], 'build', True, True),
+            (['/build'], 'a/build', True, False),
+            (['a/b'], 'a/b', False, True),
+            (['a/b'], 'c/a/b', False, False),
+            (['tmp/'], 'tmp', True, True),
+            (['tmp/'], 'tmp', False, False),
+            (['docs/**/*.bak'], 'docs/x.bak', False, True),
+            (['docs/**/*.bak'], 'docs/a/b/x.bak', False, True),
+            (['docs/**/*.bak'], 'x/docs/x.bak', False, False),
+            (['**/cache'], 'a/b/cache', True, True),
+            (['logs/**'], 'logs/a/b', False, True),
+            (['a?c'], 'abc', False, True),
+            (['a?c'], 'a/c', False, False),
+            (['*.[oa]'], 'x.o', False, True),
+            (['*.[!oa]'], 'x.o', False, False),
+            (['*.[!oa]'], 'x.c', False, True),
+        ]
+        for patterns, path, is_dir, ignored in tests:
+            rules = pykutils.code2tex.parse_ignore(patterns, 'base')
+            path = os.path.join('base', *path.split('/'))
+            self.assertEqual(pykutils.code2tex.is_ignored(path, is_dir, rules),
+                             ignored, (patterns, path, is_dir))
+
+    def test_nested_base(self):
+        rules = (pykutils.code2tex.parse_ignore(['/x'], 'base') +
+                 pykutils.code2tex.parse_ignore(['/y'],
+                                                os.path.join('base', 'sub')))
+        tests = [('x', True), ('sub/x', False), ('y', False),
+                 ('sub/y', True)]
+        for path, ignored in tests:
+            path = os.path.join('base', *path.split('/'))
+            self.assertEqual(pykutils.code2tex.is_ignored(path, False, rules),
+                             ignored, path)
+
+
+class TestIsBinary(TreeTestCase):
+    files = {
+        'text': b'hello\n',
+        'empty': b'',
+        'binary': b'\x7fELF\0\0',
+        'late': b'x' * 8192 + b'\0',
+    }
+
+    def test_is_binary(self):
+        tests = [('text', False), ('empty', False), ('binary', True),
+                 ('late', False), ('missing', False)]
+        for path, binary in tests:
+            self.assertEqual(pykutils.code2tex.is_binary(self.path(path)),
+                             binary, path)
+
+
+class TestWalk(TreeTestCase):
+    files = {
+        '.gitignore': (b'*.log\n!keep.log\n/build\ntmp/\n'
+                       b'docs/**/*.bak\na?c.txt\n'),
+        '.git/HEAD': b'ref: refs/heads/master\n',
+        'a.py': b'a',
+        'abc.txt': b'abc',
+        'bin.dat': b'\0\1\2',
+        'build/out.c': b'out',
+        'docs/a/b/c.bak': b'bak',
+        'docs/c.bak': b'bak',
+        'docs/d.md': b'd',
+        'keep.log': b'keep',
+        'tmp/z.c': b'z',
+        'x.log': b'x',
+        'sub/.gitignore': b'*.txt\n!important.txt\n',
+        'sub/build/y.c': b'y',
+        'sub/important.txt': b'important',
+        'sub/notes.txt': b'notes',
+        'sub/tmp': b'not a directory',
+    }
+
+    expected = ['.gitignore', 'a.py', 'docs/d.md', 'keep.log',
+                'sub/.gitignore', 'sub/build/y.c', 'sub/important.txt',
+                'sub/tmp']
+
+    def test_walk(self):
+        self.assertEqual(self.walk(), self.expected)
+
+    def test_no_gitignore(self):
+        self.assertEqual(self.walk(gitignore=False), sorted(
+            x for x in self.files if not x.startswith('.git/') and
+            x != 'bin.dat'))
+
+    def test_excludes(self):
+        self.assertEqual(self.walk(['*.c', 'sub/']),
+                         ['.gitignore', 'a.py', 'docs/d.md', 'keep.log'])
+
+    def test_file_argument(self):
+        path = self.path('x.log')
+        self.assertEqual(list(pykutils.code2tex.walk([path])), [path])
+
+    def test_sniff_after_filter(self):
+        sniffed = []
+
+        def is_binary(path, is_binary=pykutils.code2tex.is_binary):
+            sniffed.append(os.path.relpath(path, self.root).replace(os.sep,
+                                                                    '/'))
+            return is_binary(path)
+
+        with unittest.mock.patch('pykutils.code2tex.is_binary', is_binary):
+            self.assertEqual(self.walk(), self.expected)
+        self.assertEqual(sorted(sniffed), sorted(self.expected + ['bin.dat']))
+
+    def test_unreadable_dir(self):
+        locked = self.path('docs')
+        errors = []
+
+        def scandir(path, scandir=os.scandir):
+            if path == locked:
+                raise PermissionError(13, 'Permission denied', path)
+            return scandir(path)
+
+        with unittest.mock.patch('os.scandir', scandir):
+            paths = self.walk(onerror=errors.append)
+        self.assertEqual(paths, [x for x in self.expected
+                                 if not x.startswith('docs/')])
+        self.assertEqual([e.filename for e in errors], [locked])
+
+    @unittest.skipUnless(shutil.which('git'), 'git is not installed')
+    def test_git(self):
+        shutil.rmtree(self.path('.git'))
+        subprocess.check_call(['git', 'init', '-q', self.root])
+        out = subprocess.check_output(['git', 'ls-files', '--others',
+                                       '--exclude-standard'],
+                                      cwd=self.root, universal_newlines=True)
+        files = sorted(x for x in out.splitlines() if x != 'bin.dat')
+        self.assertEqual(sorted(self.walk()), files)
+
+
+class TestParallel(TreeTestCase):
+    files = dict(('src/f{0:02d}.py'.format(i),
+                  'def f{0}():\n    return {0}\n'.format(i).encode())
+                 for i in range(12))
+    files['src/notes.txt'] = b'notes\n'
+    files['src/main.c'] = b'int main(void) { return 0; }\n'
+
+    def code2tex(self, paths, **kwargs):
+        out = io.StringIO()
+        pykutils.code2tex.code2tex(out, paths, **kwargs)
+        return out.getvalue()
+
+    def test_jobs(self):
+        # Not sorted, to check that the order of `paths` is kept
+        paths = sorted(self.path(x) for x in self.files)[::-1]
+        expected = self.code2tex(paths, jobs=1)
+        for i, path in enumerate(paths):
+            self.assertIn(pykutils.code2tex.filter_tex(path), expected)
+            if i:
+                self.assertLess(
+                    expected.index(pykutils.code2tex.filter_tex(paths[i - 1])),
+                    expected.index(pykutils.code2tex.filter_tex(path)))
+        self.assertEqual(self.code2tex(paths, jobs=2), expected)
+        self.assertEqual(self.code2tex(paths, jobs=3, stream_threshold=40),
+                         self.code2tex(paths, jobs=1, stream_threshold=40))
+
+    def test_no_fork(self):
+        # walk() runs threads, so workers must not be forked from this process
+        self.assertNotEqual(
+            pykutils.code2tex._mp_context().get_start_method(), 'fork')
+
+    def test_window(self):
+        paths = sorted(self.path(x) for x in self.files)
+        blocks = list(pykutils.code2tex.highlight_parallel(paths, jobs=2,
+                                                           window=1))
+        self.assertEqual([x[0] for x in blocks], paths)
+        formatter = pykutils.code2tex.get_formatter()
+        for path, block in blocks:
+            self.assertEqual(block,
+                             pykutils.code2tex.highlight(path, formatter))
+
+
+class TestHighlightCache(TreeTestCase):
+    files = {
+        'a.py': b'a = 1\n',
+        'b.py': b'b = 2\n',
+    }
+
+    def cache(self, max_size=1024*1024):
+        return pykutils.code2tex.HighlightCache(self.path('cache'), max_size)
+
+    def test_hits(self):
+        formatter = pykutils.code2tex.get_formatter()
+        cache = self.cache()
+        paths = [self.path('a.py'), self.path('b.py')]
+        blocks = [pykutils.code2tex.highlight(x, formatter, cache=cache)
+                  for x in paths]
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        self.assertEqual([pykutils.code2tex.highlight(x, formatter,
+                                                      cache=cache)
+                          for x in paths], blocks)
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        self.assertEqual(blocks, [pykutils.code2tex.highlight(x, formatter)
+                                  for x in paths])
+        # The style is part of the key
+        pykutils.code2tex.highlight(paths[0],
+                                    pykutils.code2tex.get_formatter('emacs'),
+                                    cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (2, 3))
+        self.assertEqual(cache.stats(), '2 hits, 3 misses (40.0% hit rate), '
+                         '0 evictions')
+
+    def test_parallel_hits(self):
+        paths = [self.path('a.py'), self.path('b.py')]
+        cache = self.cache()
+        out = io.StringIO()
+        pykutils.code2tex.code2tex(out, paths, jobs=2, cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        cache = self.cache()
+        out2 = io.StringIO()
+        pykutils.code2tex.code2tex(out2, paths, jobs=2, cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (2, 0))
+        self.assertEqual(out2.getvalue(), out.getvalue())
+
+    def test_evict(self):
+        cache = self.cache(max_size=20)
+        keys = ['{0:02x}'.format(i) * 32 for i in range(4)]
+        for i, key in enumerate(keys):
+            cache.put(key, 'x' * 10)
+            os.utime(cache._entry_path(key), (1000 + i, 1000 + i))
+        # A hit makes the oldest entry the most recently used
+        self.assertEqual(cache.get(keys[0]), 'x' * 10)
+        cache.evict()
+        self.assertEqual(cache.evictions, 2)
+        self.assertEqual([os.path.exists(cache._entry_path(x)) for x in keys],
+                         [True, False, False, True])
+        cache.evict()
+        self.assertEqual(cache.evictions, 2)
+
+
+class TestHighlightStream(TreeTestCase):
+    files = {
+        'plain.py': b'def f():\n    return 1\n',
+        'blank.py': b'\n\n\ndef f():\n    return 1\n\n\n\n',
+        'inner.py': b'a = 1\n\n\n\nb = 2\n',
+        'noeol.py': b'x = 1',
+        'empty.py': b'',
+        'blanks.py': b'\n\n\n',
+        'text.txt': b'\n  indented\n\ttab\n\n',
+    }
+
+    def stream(self, path, **kwargs):
+        out = io.StringIO()
+        pykutils.code2tex.highlight_stream(out, path, self.formatter,
+                                           **kwargs)
+        return out.getvalue()
+
+    def setUp(self):
+        super(TestHighlightStream, self).setUp()
+        self.formatter = pykutils.code2tex.get_formatter()
+
+    def test_single_chunk(self):
+        for name in self.files:
+            path = self.path(name)
+            self.assertEqual(self.stream(path),
+                             pykutils.code2tex.highlight(path, self.formatter),
+                             name)
+
+    def test_chunks(self):
+        # Chunk boundaries between statements do not change the output
+        for name in ('plain.py', 'blank.py', 'inner.py'):
+            path = self.path(name)
+            self.assertEqual(self.stream(path, chunk_size=1),
+                             pykutils.code2tex.highlight(path, self.formatter),
+                             name)
+
+
+def lexer_names():
+    """Returns a sample of file names matching pygments filename patterns"""
+    import pygments.lexers
+    names = []
+    for _, _, patterns, _ in pygments.lexers.get_all_lexers():
+        for x in patterns:
+            x = x.replace('*', 'x').replace('?', 'x')
+            while '[' in x:
+                i = x.index('[')
+                j = x.index(']', i)
+                x = x[:i] + x[i + 1] + x[j + 1:]
+            names.append(x)
+    # pygments' lookup is slow, so only check some of them
+    return names[::20] + ['README', 'x.unknownext', 'Makefile', 'x.tar.gz',
+                          'x.py', 'x.h', 'x.pl', 'x.m', 'x.inc', 'x.txt',
+                          'CMakeLists.txt', 'x.html', 'x.xml', '.bashrc']
+
+
+class TestLexerIndex(TreeTestCase):
+    def names(self, lexers, names):
+        return [type(lexers.get_lexer(x)).__name__ for x in names]
+
+    def test_pygments(self):
+        import pygments.lexers
+        import pygments.util
+        names = lexer_names()
+        expected = []
+        for x in names:
+            try:
+                lexer = pygments.lexers.get_lexer_for_filename(x)
+            except pygments.util.ClassNotFound:
+                lexer = pygments.lexers.get_lexer_by_name('text')
+            expected.append(type(lexer).__name__)
+        self.assertEqual(self.names(pykutils.code2tex.LexerIndex(), names),
+                         expected)
+
+    def test_overrides(self):
+        lexers = pykutils.code2tex.LexerIndex([('*.h', 'cpp'), ('*.h', 'c'),
+                                               ('*.foo', 'python')])
+        self.assertEqual(self.names(lexers, ['x.h', 'x.foo', 'x.c']),
+                         ['CppLexer', 'PythonLexer', 'CLexer'])
+
+    def test_persist(self):
+        path = self.path('cache/lexers.json')
+        names = lexer_names()
+        built = pykutils.code2tex.LexerIndex(path=path)
+        self.assertTrue(os.path.exists(path))
+        with unittest.mock.patch.object(pykutils.code2tex.LexerIndex,
+                                        '_build') as build:
+            loaded = pykutils.code2tex.LexerIndex(path=path)
+        self.assertFalse(build.called)
+        self.assertEqual(self.names(loaded, names), self.names(built, names))
+        self.assertEqual(loaded._filenames, built._filenames)
+        self.assertEqual(loaded._extensions, built._extensions)
+        self.assertEqual([x[:2] for x in loaded._patterns],
+                         [x[:2] for x in built._patterns])
+
+    def test_persist_invalid(self):
+        path = self.path('lexers.json')
+        for data in ('{"version": "0", "patterns": []}', 'not json'):
+            with open(path, 'w') as f:
+                f.write(data)
+            lexers = pykutils.code2tex.LexerIndex(path=path)
+            self.assertEqual(self.names(lexers, ['x.py']), ['PythonLexer'])
+            # The index was rebuilt and saved again
+            self.assertTrue(pykutils.code2tex.LexerIndex(path=path)._load())
+
+
+if __name__ == '__main__':
+    unittest.main()
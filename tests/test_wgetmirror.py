@@ -0,0 +1,372 @@
+import contextlib
+import functools
+import http.server
+import io
+import os
+import os.path
+import shutil
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+import pykutils.wgetmirror
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    # Serve extensionless files as HTML, to exercise -E
+    extensions_map = dict(http.server.SimpleHTTPRequestHandler.extensions_map,
+                          **{'': 'text/html'})
+
+    def log_message(self, *args):
+        pass
+
+
+class SiteTestCase(unittest.TestCase):
+    """Serves `files` (path -> bytes) from a local http.server, and mirrors
+    into `self.dst`"""
+
+    files = {}
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp, 'site')
+        for path, data in self.files.items():
+            path = os.path.join(self.root, *path.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+        handler = functools.partial(QuietHandler, directory=self.root)
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.host = '127.0.0.1:{0}'.format(self.server.server_address[1])
+        self.dst = os.path.join(self.tmp, 'a', 'b', 'c', 'mirror')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def url(self, path):
+        return 'http://{0}/{1}'.format(self.host, path)
+
+    def mirror(self, *paths, **kwargs):
+        kwargs.setdefault('timeout', 5)
+        return pykutils.wgetmirror.mirror([self.url(x) for x in paths],
+                                          self.dst, **kwargs)
+
+    def local(self, path):
+        return os.path.join(self.dst,
+                            pykutils.wgetmirror.local_path(self.url(path)))
+
+    def read(self, path):
+        with open(self.local(path), 'rb') as f:
+            return f.read()
+
+
+class TestLocalPath(unittest.TestCase):
+    def test_encoded_dot_segments(self):
+        path = pykutils.wgetmirror.local_path(
+            'http://h/docs/%2e%2e/%2e%2e/%2e%2e/pwned')
+        self.assertEqual(path, os.path.join('h', 'docs', 'pwned'))
+
+    def test_encoded_slash(self):
+        path = pykutils.wgetmirror.local_path('http://h/a/b%2Fc')
+        self.assertEqual(path, os.path.join('h', 'a', 'b%2Fc'))
+
+    def test_adjust_extension(self):
+        local_path = pykutils.wgetmirror.local_path
+        self.assertEqual(local_path('http://h/a/', 'text/html'),
+                         os.path.join('h', 'a', 'index.html'))
+        self.assertEqual(local_path('http://h/a', 'text/html'),
+                         os.path.join('h', 'a.html'))
+        self.assertEqual(local_path('http://h/a?x=1', 'text/css',
+                                    windows=False),
+                         os.path.join('h', 'a?x=1.css'))
+        self.assertEqual(local_path('http://h/a.png', 'image/png'),
+                         os.path.join('h', 'a.png'))
+
+
+    def test_windows(self):
+        tests = [
+            ('http://h:8080/a?x=1', os.path.join('h+8080', 'a@x=1')),
+            ('http://h/a?x=1:2', os.path.join('h', 'a@x=1%3A2')),
+            ('http://h/a%3Cb%7C/c*d', os.path.join('h', 'a%3Cb%7C', 'c%2Ad')),
+            ('http://h/a:b/', os.path.join('h', 'a%3Ab', 'index.html')),
+        ]
+        for url, path in tests:
+            self.assertEqual(pykutils.wgetmirror.local_path(url,
+                                                            windows=True),
+                             path, url)
+        self.assertEqual(pykutils.wgetmirror.local_path('http://h:8080/a?x',
+                                                        windows=False),
+                         os.path.join('h:8080', 'a?x'))
+        # Links to such files are converted to the restricted names
+        path = pykutils.wgetmirror.local_path('http://h/a?x=1', 'text/css',
+                                              windows=True)
+        self.assertEqual(pykutils.wgetmirror.relative_url(
+            path, os.path.join('h', 'index.html')), 'a@x=1.css')
+
+
+class TestTraversal(SiteTestCase):
+    files = {
+        'docs/index.html': b'<a href="%2e%2e/%2e%2e/%2e%2e/pwned">x</a>',
+        'pwned': b'pwned',
+    }
+
+    def test_normalize_url(self):
+        url = pykutils.wgetmirror.normalize_url(
+            self.url('docs/%2e%2e/%2e%2e/%2e%2e/pwned'))
+        self.assertEqual(url, self.url('pwned'))
+
+    def test_traversal(self):
+        self.mirror('docs/', robots=False)
+        self.assertTrue(os.path.exists(self.local('docs/index.html')))
+        # -np: the link resolves to /pwned, outside of /docs/
+        self.assertFalse(os.path.exists(self.local('pwned')))
+        for dirpath, _, filenames in os.walk(self.tmp):
+            if dirpath.startswith(self.dst) or dirpath.startswith(self.root):
+                continue
+            self.assertEqual(filenames, [], dirpath)
+
+
+class TestMirror(SiteTestCase):
+    files = {
+        'docs/index.html': (b'<link rel="stylesheet" href="style.css">'
+                            b'<img src="../img/logo.png">'
+                            b'<a href="page#top">page</a>'
+                            b'<a href="../other.html">other</a>'),
+        'docs/style.css': b'body { background: url(bg.png) }',
+        'docs/bg.png': b'bg',
+        'docs/page': b'<a href="index.html">index</a>',
+        'img/logo.png': b'logo',
+        'other.html': b'other',
+    }
+
+    def test_mirror(self):
+        m = self.mirror('docs/', robots=False)
+        self.assertEqual(m.errors, 0)
+        # -p: requisites are fetched even outside of the parent directory
+        self.assertEqual(self.read('img/logo.png'), b'logo')
+        self.assertEqual(self.read('docs/bg.png'), b'bg')
+        # -np: links outside of the parent directory are not followed
+        self.assertFalse(os.path.exists(self.local('other.html')))
+        # -E
+        self.assertEqual(self.read('docs/page.html'),
+                         b'<a href="index.html">index</a>')
+        # -k
+        index = self.read('docs/index.html').decode()
+        self.assertIn('href="style.css"', index)
+        self.assertIn('src="../img/logo.png"', index)
+        self.assertIn('href="page.html#top"', index)
+        self.assertIn('href="{0}"'.format(self.url('other.html')), index)
+
+
+class TestPageRequisites(SiteTestCase):
+    files = {
+        'docs/index.html': (b'<a href="../static/s.css">css</a>'
+                            b'<link rel="stylesheet" href="../static/s.css">'),
+        'static/s.css': b'body { color: red }',
+    }
+
+    def test_link_then_requisite(self):
+        self.mirror('docs/', robots=False)
+        self.assertEqual(self.read('static/s.css'), b'body { color: red }')
+
+
+class TestRobots(SiteTestCase):
+    files = {
+        'robots.txt': b'User-agent: *\nDisallow: /docs/private/\n',
+        'docs/index.html': b'<a href="private/x.html">x</a>'
+                           b'<a href="public/y.html">y</a>',
+        'docs/private/x.html': b'x',
+        'docs/public/y.html': b'y',
+    }
+
+    def test_robots(self):
+        self.mirror('docs/')
+        self.assertFalse(os.path.exists(self.local('docs/private/x.html')))
+        self.assertEqual(self.read('docs/public/y.html'), b'y')
+
+
+class TestDedupe(SiteTestCase):
+    files = {
+        'docs/index.html': (b'<a href="index.html">index</a>'
+                            b'<a href="a.txt">a</a><a href="b.txt">b</a>'),
+        'docs/a.txt': b'same',
+        'docs/b.txt': b'same',
+    }
+
+    def setUp(self):
+        super(TestDedupe, self).setUp()
+        os.utime(os.path.join(self.root, 'docs', 'a.txt'), (1000, 1000))
+        os.utime(os.path.join(self.root, 'docs', 'b.txt'), (2000, 2000))
+
+    def test_dedupe(self):
+        m = self.mirror('docs/', robots=False, jobs=1, dedupe=True)
+        self.assertTrue(os.path.samefile(self.local('docs/a.txt'),
+                                         self.local('docs/b.txt')))
+        # The shared file keeps the timestamp of its first download
+        self.assertEqual(os.stat(self.local('docs/a.txt')).st_mtime, 1000)
+        # docs/ and docs/index.html are one file, so only b.txt is a saving
+        self.assertEqual(m.objects.saved, 4)
+        files, size, unique = m.dedupe_report()
+        index = len(self.files['docs/index.html'])
+        self.assertEqual((files, size, unique), (3, index + 8, index + 4))
+
+
+    def objects(self):
+        store = os.path.join(self.dst, pykutils.wgetmirror.objects_name)
+        return set(prefix + name for prefix in os.listdir(store)
+                   for name in os.listdir(os.path.join(store, prefix)))
+
+    def test_gc(self):
+        index = os.path.join(self.root, 'docs', 'index.html')
+        for i in range(3):
+            with open(index, 'ab') as f:
+                f.write(b'<!-- edit -->')
+            os.utime(index, (3000 + i, 3000 + i))
+            m = self.mirror('docs/', robots=False, dedupe=True)
+            digests = set(x['sha256'] for x in m.manifest.entries.values())
+            self.assertEqual(self.objects(), digests)
+        self.assertEqual(m.objects.removed, 1)
+
+
+class TestDedupeReport(SiteTestCase):
+    files = {
+        'docs/index.html': b'<a href="page">page</a>',
+        'docs/page': b'page',
+    }
+
+    def test_converted(self):
+        m = self.mirror('docs/', robots=False, dedupe=True)
+        # The converted index.html is a file of its own, and the store keeps
+        # its original
+        index = self.read('docs/index.html')
+        self.assertEqual(index, b'<a href="page.html">page</a>')
+        size = len(index) + 4
+        disk = size + len(self.files['docs/index.html'])
+        self.assertEqual(m.dedupe_report(), (2, size, disk))
+
+
+class TestIncremental(SiteTestCase):
+    files = {
+        'docs/index.html': (b'<link rel="stylesheet" href="s.css">'
+                            b'<a href="a.html">a</a><a href="b.html">b</a>'),
+        'docs/s.css': b'body {}',
+        'docs/a.html': b'a',
+        'docs/b.html': b'b',
+    }
+
+    def setUp(self):
+        super(TestIncremental, self).setUp()
+        for path in self.files:
+            os.utime(os.path.join(self.root, *path.split('/')),
+                     (1000000, 1000000))
+
+    def test_unchanged(self):
+        m = self.mirror('docs/', robots=False)
+        self.assertEqual(m.not_modified, 0)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.dst, pykutils.wgetmirror.manifest_name)))
+        index = self.read('docs/index.html')
+        m = self.mirror('docs/', robots=False)
+        self.assertEqual((len(m.files), m.not_modified, m.bytes), (4, 4, 0))
+        self.assertEqual(m.errors, 0)
+        self.assertEqual(self.read('docs/index.html'), index)
+
+    def test_changed(self):
+        self.mirror('docs/', robots=False)
+        path = os.path.join(self.root, 'docs', 'a.html')
+        with open(path, 'wb') as f:
+            f.write(b'a2')
+        os.utime(path, (2000000, 2000000))
+        m = self.mirror('docs/', robots=False)
+        self.assertEqual((len(m.files), m.not_modified, m.bytes), (4, 3, 2))
+        self.assertEqual(self.read('docs/a.html'), b'a2')
+
+    def check_removed(self, dedupe):
+        self.mirror('docs/', robots=False, dedupe=dedupe)
+        self.assertIn(b'href="b.html"', self.read('docs/index.html'))
+        os.unlink(os.path.join(self.root, 'docs', 'b.html'))
+        m = self.mirror('docs/', robots=False, dedupe=dedupe)
+        self.assertEqual(m.errors, 1)
+        # The unchanged index.html is converted again, so that its link to
+        # b.html becomes absolute
+        index = self.read('docs/index.html')
+        self.assertIn('href="{0}"'.format(self.url('docs/b.html')).encode(),
+                      index)
+        self.assertIn(b'href="a.html"', index)
+        self.assertIn(b'href="s.css"', index)
+        self.assertEqual(m.pool._idle, {})
+        return m
+
+    def test_removed(self):
+        # index.html is downloaded again to get its original body
+        m = self.check_removed(False)
+        size = len(self.files['docs/index.html'])
+        self.assertEqual((len(m.files), m.not_modified, m.bytes),
+                         (3, 2, size))
+
+    def test_removed_dedupe(self):
+        # index.html is restored from the object store
+        m = self.check_removed(True)
+        self.assertEqual((len(m.files), m.not_modified, m.bytes), (3, 3, 0))
+
+
+class StaleConnection(object):
+    """A keep-alive connection that was closed by the server"""
+
+    def request(self, *args, **kwargs):
+        raise ConnectionResetError()
+
+    def close(self):
+        pass
+
+
+class TestConnectionPool(SiteTestCase):
+    files = {'index.html': b'index'}
+
+    def test_stale_connections(self):
+        m = pykutils.wgetmirror.Mirror([self.url('')], self.dst, timeout=5)
+        url = self.url('index.html')
+        key = pykutils.wgetmirror.url_host(url)
+        for _ in range(2):
+            m.pool.put(key, StaleConnection())
+        _, conn, resp = m._request(url)
+        try:
+            self.assertEqual(resp.status, 200)
+            self.assertEqual(resp.read(), b'index')
+        finally:
+            conn.close()
+
+
+class TestMain(unittest.TestCase):
+    def test_invalid_jobs(self):
+        for args in (['-j', '0'], ['--per-host', '0']):
+            with self.assertRaises(SystemExit) as cm, \
+                    contextlib.redirect_stderr(io.StringIO()):
+                pykutils.wgetmirror.main(args + ['http://127.0.0.1:1/'],
+                                         'wgetmirror')
+            self.assertEqual(cm.exception.code, 2)
+
+    def test_wget_fallback(self):
+        tests = [
+            (['-nH', '--reject=*.zip', 'http://h/'],
+             ['-nH', '--reject=*.zip', 'http://h/']),
+            (['--wget', '-P', 'out', 'http://h/'], ['-P', 'out', 'http://h/']),
+            (['-i', 'urls.txt'], ['-i', 'urls.txt']),
+        ]
+        for args, expected in tests:
+            with unittest.mock.patch('subprocess.call',
+                                     return_value=0) as call:
+                self.assertEqual(pykutils.wgetmirror.main(args), 0)
+            call.assert_called_once_with(pykutils.wgetmirror.wget_args +
+                                         expected)
+
+
+if __name__ == '__main__':
+    unittest.main()